@@ -1,102 +1,337 @@
 import os  
-import json  
-import pandas as pd  
+import re  
+import pickle  
+import sqlite3  
+import orjson  
+import numpy as np  
 import logging  
+import atexit  
+import queue  
+import asyncio  
 import ccxt  
+import ccxt.async_support as ccxt_async  
 import time  
+import itertools  
+from concurrent.futures import ThreadPoolExecutor  
+from logging.handlers import QueueHandler, QueueListener  
 from datetime import datetime, timedelta, timezone  
 from typing import Dict, List, Tuple, Optional  
   
-# Configure logging  
+# Configure logging; LOG_LEVEL=WARNING skips most of the per-request log I/O.  
+# The log file gets everything at LOG_LEVEL, the console only warnings and errors.  
+log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')  
+file_handler = logging.FileHandler('crypto_data_fetch.log')  
+file_handler.setFormatter(log_formatter)  
+stream_handler = logging.StreamHandler()  
+stream_handler.setLevel(logging.WARNING)  
+stream_handler.setFormatter(log_formatter)  
+  
+# Records are handed to a background thread through a queue, so callers never block on log I/O  
+log_queue = queue.SimpleQueue()  
+queue_handler = QueueHandler(log_queue)  
+queue_handler.setFormatter(logging.Formatter('%(message)s'))  
+log_listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)  
+log_listener.start()  
+atexit.register(log_listener.stop)  
+  
 logging.basicConfig(  
-    level=logging.INFO,  
-    format='%(asctime)s - %(levelname)s - %(message)s',  
-    handlers=[  
-        logging.FileHandler('crypto_data_fetch.log'),  
-        logging.StreamHandler()  
-    ]  
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),  
+    handlers=[queue_handler]  
 )  
 logger = logging.getLogger(__name__)  
   
+class AsyncTokenBucket:  
+    """Token bucket rate limiter for coroutines sharing one exchange, backing off when it is throttled."""  
+      
+    def __init__(self, rate: float, capacity: float, recovery_period: float = 10.0):  
+        """Refill `rate` tokens per second up to `capacity`; each request takes tokens according to its cost."""  
+        self.max_rate = rate  
+        self.rate = rate  
+        self.capacity = capacity  
+        self.tokens = capacity  
+        self.updated = time.monotonic()  
+        self.lock = asyncio.Lock()  
+        # Seconds without throttling before the rate may double back up  
+        self.recovery_period = recovery_period  
+        self.rate_changed = self.updated  
+      
+    async def acquire(self, cost: Optional[float] = None) -> None:  
+        """Wait until the bucket is out of debt, then take `cost` tokens (default 1)."""  
+        # Same leaky bucket as CCXT's throttler: a request may overdraw the bucket, and the next one  
+        # waits until it is paid back, so costly endpoints space out the requests that follow them  
+        async with self.lock:  
+            while True:  
+                now = time.monotonic()  
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)  
+                self.updated = now  
+                if self.tokens >= 0:  
+                    self.tokens -= 1 if cost is None else cost  
+                    return  
+                await asyncio.sleep(-self.tokens / self.rate)  
+      
+    def slow_down(self) -> None:  
+        """Halve the fill rate, down to a tenth of the starting rate, and drop any saved-up burst."""  
+        self.rate = max(self.max_rate / 10, self.rate / 2)  
+        self.tokens = min(self.tokens, 0.0)  
+        self.rate_changed = time.monotonic()  
+      
+    def speed_up(self) -> None:  
+        """Undo one halving once a full recovery_period has passed without throttling."""  
+        # Paced by time rather than by responses: with several requests in flight, the responses  
+        # already on their way would otherwise undo a halving within the same second  
+        now = time.monotonic()  
+        if self.rate < self.max_rate and now - self.rate_changed >= self.recovery_period:  
+            self.rate = min(self.max_rate, self.rate * 2)  
+            self.rate_changed = now  
+  
 class CryptoDataFetcher:  
     """Fetches cryptocurrency candle data using CCXT."""  
       
-    def __init__(self, coin: str = "BTC", base_currency: str = "USDT", exchange_id: str = "coinbaseadvanced"):  
+    # Maximum candles per fetch_ohlcv request; larger limits get silently clipped by these exchanges  
+    OHLCV_LIMITS = {  
+        'binance': 1000,  
+        'bybit': 200,  
+        'coinbase': 300,  
+        'coinbaseadvanced': 300,  
+        'kraken': 720,  
+        'okx': 100,  
+    }  
+    DEFAULT_OHLCV_LIMIT = 500  
+      
+    # Used when the exchange doesn't advertise its supported timeframes  
+    DEFAULT_TIMEFRAMES = {  
+        '1m': '1m', '5m': '5m', '15m': '15m', '30m': '30m',  
+        '1h': '1h', '6h': '6h', '1d': '1d'  
+    }  
+      
+    # Column names of the Parquet and Excel outputs  
+    CANDLE_COLUMNS = ['startTime', 'openPrice', 'highPrice', 'lowPrice', 'closePrice', 'volume', 'turnover']  
+    PRICE_COLUMNS = CANDLE_COLUMNS[1:6]  
+      
+    # CCXT candle rows parsed in one pass: exact int64 timestamps, float64 prices and volume (None becomes NaN)  
+    CANDLE_DTYPE = np.dtype([('startTime', np.int64)] + [(name, np.float64) for name in PRICE_COLUMNS])  
+      
+    # Market metadata barely changes, so reuse it across runs for a day  
+    MARKETS_CACHE_DIR = os.path.expanduser('~/.cache/crypto_fetcher')  
+    MARKETS_CACHE_TTL = 24 * 60 * 60  
+      
+    # Candle files already written, so reruns for the same day skip their downloads  
+    DONE_CACHE_DIR = MARKETS_CACHE_DIR  
+      
+    # Daemon mode collects the previous day this long after UTC midnight  
+    DAEMON_RUN_OFFSET = timedelta(minutes=5)  
+      
+    def __init__(self, coin: str = "BTC", base_currency: str = "USDT", exchange_id: str = "coinbaseadvanced",  
+                 max_workers: int = 8, emit_json: bool = True, emit_xlsx: bool = True,  
+                 include_perpetual: bool = True, max_concurrency: int = 8, resample_from_1m: bool = False):  
         """Initialize the data fetcher with CCXT exchange."""  
         self.coin = coin.upper()  
         self.base_currency = base_currency.upper()  
         self.symbol = f"{self.coin}/{self.base_currency}"  
+        self.exchange_id = exchange_id  
+        self.max_workers = max_workers  
+        self.max_concurrency = max_concurrency  
+        self.resample_from_1m = resample_from_1m  
+        self.emit_json = emit_json  
+        self.emit_xlsx = emit_xlsx  
+          
+        # One sqlite index per exchange and pair of the (category, timeframe, date) files already saved  
+        clean_symbol = self.symbol.replace('/', '')  
+        self.done_cache_path = os.path.join(self.DONE_CACHE_DIR, f"{exchange_id}_{clean_symbol}_done.sqlite")  
           
         # Initialize CCXT exchange  
-        exchange_class = getattr(ccxt, exchange_id)  
-        self.exchange = exchange_class({  
-            'sandbox': False,  
-            'enableRateLimit': True,  
-        })  
+        self.exchange = self._create_exchange()  
+          
+        # Async exchange, its rate limiter and the in-flight request cap, created inside the running event loop  
+        self.async_exchange = None  
+        self.limiter = None  
+        self.request_slots = None  
           
         # Load markets to get exchange info  
-        self.exchange.load_markets()  
+        self._load_markets()  
           
         # Use exchange's actual supported timeframes  
-        self.timeframes = self.exchange.timeframes if self.exchange.timeframes else {  
-            '1m': '1m', '5m': '5m', '15m': '15m', '30m': '30m',   
-            '1h': '1h', '6h': '6h', '1d': '1d'  
-        }  
-          
-        # Categories for both spot and perpetual markets  
-        self.categories = {  
-            'spot': 'spot',  
-            'perpetual': 'swap'  # CCXT uses 'swap' for perpetual contracts  
-        }  
-          
-        # Validate symbol exists and create perpetual symbol  
-        self.spot_symbol = self.symbol  
-        self.perp_symbol = f"{self.coin}/{self.base_currency}:USDT"  # Standard perpetual format  
-          
-        if self.spot_symbol not in self.exchange.symbols:  
-            # Try common symbol variations for spot  
-            alt_symbols = [  
-                f"{self.coin}-{self.base_currency}",  
-                f"{self.coin}{self.base_currency}",  
-                f"{self.coin}_{self.base_currency}"  
-            ]  
-              
-            for alt_symbol in alt_symbols:  
-                if alt_symbol in self.exchange.symbols:  
-                    self.spot_symbol = alt_symbol  
-                    break  
-            else:  
-                available_symbols = [s for s in self.exchange.symbols if self.coin in s]  
-                logger.warning(f"Spot symbol {self.spot_symbol} not found. Available {self.coin} pairs: {available_symbols[:10]}")  
-          
-        # Check for perpetual symbol variations  
-        if self.perp_symbol not in self.exchange.symbols:  
-            perp_variations = [  
-                f"{self.coin}/{self.base_currency}:USD",  
-                f"{self.coin}-{self.base_currency}",  
-                f"{self.coin}{self.base_currency}-PERP"  
-            ]  
-              
-            for perp_var in perp_variations:  
-                if perp_var in self.exchange.symbols:  
-                    self.perp_symbol = perp_var  
-                    break  
-            else:  
-                logger.warning(f"Perpetual symbol not found for {self.coin}")  
-                self.perp_symbol = None  
+        self.timeframes = self.exchange.timeframes if self.exchange.timeframes else self.DEFAULT_TIMEFRAMES  
+          
+        # Candle duration per timeframe, used for paging and request sizing  
+        self.timeframe_ms = {tf: self.exchange.parse_timeframe(tf) * 1000 for tf in self.timeframes}  
+          
+        # Categories for spot and, optionally, perpetual markets  
+        self.categories = {'spot': 'spot'}  
+        if include_perpetual:  
+            self.categories['perpetual'] = 'swap'  # CCXT uses 'swap' for perpetual contracts  
+          
+        # exchange.symbols is a list; snapshot it into a set for O(1) membership checks  
+        self.symbol_set = set(self.exchange.symbols)  
+          
+        # Validate symbol exists and find the perpetual symbol  
+        self.spot_symbol, self.perp_symbol = self._match_symbols(include_perpetual)  
           
-        logger.info(f"Initialized {exchange_id} exchange")  
-        logger.info(f"Spot symbol: {self.spot_symbol}")  
-        logger.info(f"Perpetual symbol: {self.perp_symbol}")  
-        logger.info(f"Supported timeframes: {list(self.timeframes.keys())}")  
+        # Symbol to fetch for each category, resolved once instead of on every run  
+        self.category_symbols = {'spot': self.spot_symbol, 'perpetual': self.perp_symbol}  
+          
+        logger.info("Initialized %s exchange", exchange_id)  
+        logger.info("Spot symbol: %s", self.spot_symbol)  
+        logger.info("Perpetual symbol: %s", self.perp_symbol)  
+        logger.info("Supported timeframes: %s", list(self.timeframes.keys()))  
+          
+        # Largest batch the exchange will actually return per request  
+        self.ohlcv_limit = min(1000, self.exchange.options.get(  
+            'fetchOHLCVLimit', self.OHLCV_LIMITS.get(exchange_id, self.DEFAULT_OHLCV_LIMIT)  
+        ))  
           
         # Configure retry behavior  
         self.max_custom_retries = 3  
         self.custom_retry_delay = 5  
       
-    def get_previous_day_timestamps(self) -> Tuple[str, int, int]:  
+    def _match_symbols(self, include_perpetual: bool) -> Tuple[str, Optional[str]]:  
+        """Find the best spot and perpetual symbols for the pair in one pass over the exchange symbols."""  
+        pattern = re.compile(  
+            rf"^{re.escape(self.coin)}(?P<sep>[-/_]?){re.escape(self.base_currency)}(?P<suffix>:[A-Z]+|-PERP)?$"  
+        )  
+        # Lower rank wins: BTC/USDT over BTC-USDT over BTCUSDT over BTC_USDT for spot, and  
+        # BTC/USDT:USDT over BTC/USDT:USD over BTC-USDT over BTCUSDT-PERP over other settlements for perpetuals  
+        spot_ranks = {'/': 0, '-': 1, '': 2, '_': 3}  
+        perp_ranks = {('/', ':USDT'): 0, ('/', ':USD'): 1, ('-', None): 2, ('', '-PERP'): 3}  
+          
+        spot_symbol, spot_rank = None, len(spot_ranks)  
+        perp_symbol, perp_rank = None, len(perp_ranks) + 1  
+        available_symbols = []  
+        for symbol in self.exchange.symbols:  
+            if self.coin in symbol:  
+                available_symbols.append(symbol)  
+            match = pattern.match(symbol)  
+            if not match:  
+                continue  
+              
+            sep, suffix = match.group('sep'), match.group('suffix')  
+            if suffix is None and spot_ranks[sep] < spot_rank:  
+                spot_symbol, spot_rank = symbol, spot_ranks[sep]  
+              
+            rank = perp_ranks.get((sep, suffix))  
+            if rank is None and sep == '/' and suffix and suffix.startswith(':'):  
+                rank = len(perp_ranks)  
+            if rank is not None and rank < perp_rank:  
+                perp_symbol, perp_rank = symbol, rank  
+          
+        if spot_symbol is None:  
+            spot_symbol = self.symbol  
+            logger.warning("Spot symbol %s not found. Available %s pairs: %s", spot_symbol, self.coin, available_symbols[:10])  
+          
+        if not include_perpetual:  
+            perp_symbol = None  
+        elif perp_symbol is None:  
+            logger.warning("Perpetual symbol not found for %s", self.coin)  
+          
+        return spot_symbol, perp_symbol  
+      
+    def _create_exchange(self) -> ccxt.Exchange:  
+        """Create the synchronous CCXT exchange, used only to load markets on a markets cache miss."""  
+        exchange_class = getattr(ccxt, self.exchange_id)  
+        return exchange_class({  
+            'sandbox': False,  
+            'enableRateLimit': True,  
+        })  
+      
+    def _load_markets(self) -> None:  
+        """Load exchange markets, reusing an on-disk copy younger than MARKETS_CACHE_TTL."""  
+        cache_path = os.path.join(self.MARKETS_CACHE_DIR, f"{self.exchange_id}_markets.pkl")  
+          
+        try:  
+            if time.time() - os.path.getmtime(cache_path) < self.MARKETS_CACHE_TTL:  
+                with open(cache_path, 'rb') as f:  
+                    markets, currencies = pickle.load(f)  
+                self.exchange.set_markets(markets, currencies)  
+                logger.info("Loaded %s markets from cache %s", self.exchange_id, cache_path)  
+                return  
+        except FileNotFoundError:  
+            pass  
+        except Exception as e:  
+            logger.warning("Ignoring unreadable markets cache %s: %s", cache_path, e)  
+          
+        self.exchange.load_markets()  
+          
+        try:  
+            os.makedirs(self.MARKETS_CACHE_DIR, exist_ok=True)  
+            with open(cache_path, 'wb') as f:  
+                pickle.dump((self.exchange.markets, self.exchange.currencies), f, protocol=pickle.HIGHEST_PROTOCOL)  
+        except Exception as e:  
+            logger.warning("Could not write markets cache %s: %s", cache_path, e)  
+      
+    def _connect_done_cache(self) -> sqlite3.Connection:  
+        """Open the done cache, creating its table on first use."""  
+        os.makedirs(self.DONE_CACHE_DIR, exist_ok=True)  
+        conn = sqlite3.connect(self.done_cache_path, timeout=30)  
+        # WAL lets the writer threads record finished files without blocking each other's reads  
+        conn.execute('PRAGMA journal_mode=WAL')  
+        conn.execute(  
+            'CREATE TABLE IF NOT EXISTS done('  
+            'category TEXT, interval TEXT, date TEXT, path TEXT, PRIMARY KEY(category, interval, date))'  
+        )  
+        return conn  
+      
+    def _load_done(self, date_str: str) -> Dict[Tuple[str, str], str]:  
+        """Return the Parquet path of each (category, timeframe) already saved for date_str."""  
+        try:  
+            conn = self._connect_done_cache()  
+            try:  
+                rows = conn.execute('SELECT category, interval, path FROM done WHERE date = ?', (date_str,)).fetchall()  
+            finally:  
+                conn.close()  
+        except Exception as e:  
+            logger.warning("Ignoring unreadable done cache %s: %s", self.done_cache_path, e)  
+            return {}  
+        return {(category_name, timeframe): path for category_name, timeframe, path in rows}  
+      
+    def _mark_done(self, date_str: str, category_name: str, timeframe: str, path: str) -> None:  
+        """Record a saved file in the done cache."""  
+        try:  
+            conn = self._connect_done_cache()  
+            try:  
+                with conn:  
+                    conn.execute('INSERT OR REPLACE INTO done VALUES (?, ?, ?, ?)',  
+                                 (category_name, timeframe, date_str, path))  
+            finally:  
+                conn.close()  
+        except Exception as e:  
+            logger.warning("Could not update done cache %s: %s", self.done_cache_path, e)  
+      
+    def _create_async_exchange(self) -> ccxt_async.Exchange:  
+        """Create the asyncio CCXT exchange for all downloads; its aiohttp pool keeps connections alive."""  
+        exchange_class = getattr(ccxt_async, self.exchange_id)  
+        exchange = exchange_class({  
+            'sandbox': False,  
+            # CCXT prices each endpoint and awaits throttle(cost) before sending; _open_async_exchange  
+            # points that at self.limiter so the cost weighting is kept and the limiter can back off  
+            'enableRateLimit': True,  
+        })  
+        # Reuse the markets loaded in __init__ instead of fetching them again  
+        exchange.set_markets(self.exchange.markets, self.exchange.currencies)  
+        return exchange  
+      
+    def _open_async_exchange(self) -> None:  
+        """Create the async exchange, rate limiter and request cap unless they are already open."""  
+        if self.async_exchange is not None:  
+            return  
+        self.async_exchange = self._create_async_exchange()  
+        # Token bucket with the refill rate (tokens per ms) and capacity CCXT's own throttler would use  
+        token_bucket = self.async_exchange.tokenBucket  
+        self.limiter = AsyncTokenBucket(rate=token_bucket['refillRate'] * 1000, capacity=token_bucket['capacity'])  
+        self.async_exchange.throttle = self.limiter.acquire  
+        # Bound the number of requests in flight so slow responses can't pile up open connections  
+        self.request_slots = asyncio.Semaphore(self.max_concurrency)  
+      
+    async def close_async(self) -> None:  
+        """Close the async exchange and its connection pool."""  
+        if self.async_exchange is not None:  
+            await self.async_exchange.close()  
+            self.async_exchange = None  
+            self.limiter = None  
+            self.request_slots = None  
+      
+    def get_previous_day_timestamps(self, now: Optional[datetime] = None) -> Tuple[str, int, int]:  
         """Calculate timestamps for previous day data collection."""  
-        now_utc = datetime.now(timezone.utc)  
+        now_utc = now or datetime.now(timezone.utc)  
         yesterday_utc = now_utc - timedelta(days=1)  
         date_str = yesterday_utc.strftime('%Y-%m-%d')  
           
@@ -109,167 +344,434 @@ class CryptoDataFetcher:
           
         return date_str, start_time, end_time  
       
-    def test_server_time(self) -> bool:  
-        """Test exchange connectivity."""  
+    async def test_server_time(self) -> bool:  
+        """Test exchange connectivity on the async exchange, warming the connection the downloads will reuse."""  
         try:  
             # Test with a simple market data fetch  
-            if self.spot_symbol in self.exchange.symbols:  
-                self.exchange.fetch_ticker(self.spot_symbol)  
+            if self.spot_symbol in self.symbol_set:  
+                async with self.request_slots:  
+                    await self.async_exchange.fetch_ticker(self.spot_symbol)  
             logger.info("✓ Exchange connectivity test successful")  
             return True  
         except Exception as e:  
-            logger.error(f"✗ Exchange connectivity test failed: {str(e)}")  
+            logger.error("✗ Exchange connectivity test failed: %s", e)  
             return False  
       
-    def fetch_ohlcv_data(self, symbol: str, timeframe: str, start_time: int, end_time: int) -> Optional[List]:  
-        """Fetch OHLCV data using CCXT."""  
+    def _adapt_rate(self) -> None:  
+        """Slow the limiter when the last response reports the request quota running low, else let it recover."""  
+        # Bybit reports its per-endpoint quota and what is left of it on every response; other exchanges  
+        # don't send these headers, so for them this is simply speed_up()  
+        headers = self.async_exchange.last_response_headers or {}  
+        limit = headers.get('X-Bapi-Limit')  
+        remaining = headers.get('X-Bapi-Limit-Status')  
+        if limit and remaining and int(remaining) < 0.2 * int(limit):  
+            self.limiter.slow_down()  
+        else:  
+            self.limiter.speed_up()  
+      
+    async def _fetch_ohlcv_window(self, symbol: str, timeframe: str, since: int, until: int) -> List:  
+        """Fetch the candles opening between since and until (inclusive), retrying once on a short page."""  
+        # Ask for exactly the candles in the window, which never exceeds the exchange's batch limit  
+        limit = (until - since) // self.timeframe_ms[timeframe] + 1  
+          
+        best = []  
+        for attempt in range(2):  
+            # CCXT fetch_ohlcv method  
+            async with self.request_slots:  
+                try:  
+                    batch = await self.async_exchange.fetch_ohlcv(  
+                        symbol=symbol,  
+                        timeframe=timeframe,  
+                        since=since,  
+                        limit=limit,  
+                        params={'until': until}  
+                    )  
+                except ccxt.DDoSProtection:  
+                    # RateLimitExceeded subclasses DDoSProtection; both mean the exchange wants fewer requests  
+                    self.limiter.slow_down()  
+                    raise  
+                self._adapt_rate()  
+              
+            # Candles come back sorted and bounded by since/until, so only the edges can fall outside the window  
+            first = 0  
+            while first < len(batch) and batch[first][0] < since:  
+                first += 1  
+            last = len(batch)  
+            while last > first and batch[last - 1][0] > until:  
+                last -= 1  
+            if last - first > len(best):  
+                best = batch[first:last]  
+              
+            # An empty page means the window has no candles, e.g. a weekly candle opening outside the day  
+            if not best:  
+                logger.debug("No %s %s candles from %d", symbol, timeframe, since)  
+                break  
+            if len(best) >= limit / 2:  
+                break  
+            # A page less than half full is more often truncated by throttling than missing data, so ask  
+            # for the window once more, after slowing the limiter rather than retrying straight away  
+            logger.debug("Got %d of %d %s %s candles from %d (attempt %d)",  
+                         len(best), limit, symbol, timeframe, since, attempt + 1)  
+            if attempt == 0:  
+                self.limiter.slow_down()  
+          
+        return best  
+      
+    async def fetch_ohlcv_data(self, symbol: str, timeframe: str, start_time: int, end_time: int) -> Optional[List]:  
+        """Fetch OHLCV data using CCXT, requesting all pages of the time range concurrently."""  
+        # Split the range into windows of at most one batch each; the pages are independent, so they  
+        # can be in flight together instead of each waiting for the previous one's last timestamp  
+        window_ms = self.ohlcv_limit * self.timeframe_ms[timeframe]  
+        windows = [  
+            (since, min(end_time, since + window_ms - 1))  
+            for since in range(start_time, end_time + 1, window_ms)  
+        ]  
+          
+        # Pages are kept in window order, so they concatenate in time order  
+        batches = [None] * len(windows)  
+        pending = list(range(len(windows)))  
         for attempt in range(self.max_custom_retries):  
-            try:  
-                logger.info(f"Fetching {symbol} {timeframe} data (attempt {attempt + 1})")  
-                  
-                # CCXT fetch_ohlcv method  
-                ohlcv = self.exchange.fetch_ohlcv(  
-                    symbol=symbol,  
-                    timeframe=timeframe,  
-                    since=start_time,  
-                    limit=1000  
-                )  
-                  
-                # Filter data within time range  
-                filtered_data = [  
-                    candle for candle in ohlcv   
-                    if start_time <= candle[0] <= end_time  
-                ]  
-                  
-                logger.info(f"Fetched {len(filtered_data)} candles for {symbol} {timeframe}")  
+            logger.debug("Fetching %s %s data (attempt %d)", symbol, timeframe, attempt + 1)  
+              
+            # Let every window finish rather than failing fast, so a retry only repeats the windows that failed  
+            results = await asyncio.gather(*(  
+                self._fetch_ohlcv_window(symbol, timeframe, *windows[index])  
+                for index in pending  
+            ), return_exceptions=True)  
+              
+            failed = []  
+            for index, result in zip(pending, results):  
+                if isinstance(result, BaseException):  
+                    logger.error("Exception on attempt %d for %s %s from %d: %s",  
+                                 attempt + 1, symbol, timeframe, windows[index][0], result)  
+                    failed.append(index)  
+                else:  
+                    batches[index] = result  
+              
+            if not failed:  
+                filtered_data = list(itertools.chain.from_iterable(batches))  
+                logger.debug("Fetched %d candles for %s %s", len(filtered_data), symbol, timeframe)  
                 return filtered_data  
-                  
-            except Exception as e:  
-                logger.error(f"Exception on attempt {attempt + 1}: {str(e)}")  
-                if attempt < self.max_custom_retries - 1:  
-                    time.sleep(self.custom_retry_delay)  
-                    continue  
-                return None  
+              
+            pending = failed  
+            if attempt < self.max_custom_retries - 1:  
+                await asyncio.sleep(self.custom_retry_delay)  
           
         return None  
       
+    def _write_excel(self, excel_path: str, timestamps: np.ndarray, rows: List) -> None:  
+        """Stream candle rows to an Excel file row by row; None values are left as blank cells."""  
+        # Imported on first use so runs with EMIT_XLSX=0 never load it  
+        import xlsxwriter  
+          
+        # constant_memory flushes each row as soon as the next one starts, so rows must be written in order  
+        workbook = xlsxwriter.Workbook(excel_path, {'constant_memory': True, 'nan_inf_to_errors': True})  
+        worksheet = workbook.add_worksheet()  
+          
+        # Cells written without their own format pick up the column's date format  
+        date_format = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})  
+        worksheet.set_column(0, 0, 19, date_format)  
+          
+        # Excel stores datetimes as days since 1899-12-30, where the Unix epoch is day 25569  
+        serial_dates = timestamps / 86_400_000 + 25569  
+          
+        worksheet.write_row(0, 0, self.CANDLE_COLUMNS)  
+        for row, (serial_date, row_values) in enumerate(zip(serial_dates.tolist(), rows), start=1):  
+            worksheet.write_number(row, 0, serial_date)  
+            worksheet.write_row(row, 1, row_values)  
+          
+        workbook.close()  
+      
+    def _output_dir(self, date_str: str, category_name: str, timeframe: str) -> str:  
+        """Build the directory holding one timeframe's files, e.g. 2024-01-01/spot/1h."""  
+        return os.path.join(date_str, category_name, timeframe)  
+      
+    def _output_path(self, date_str: str, category_name: str, timeframe: str, symbol: str, extension: str) -> str:  
+        """Build the path of one output file, e.g. 2024-01-01/spot/1h/BTCUSDT_1h_2024-01-01.parquet."""  
+        clean_symbol = symbol.replace('/', '').replace(':', '')  
+        return os.path.join(self._output_dir(date_str, category_name, timeframe),  
+                            f"{clean_symbol}_{timeframe}_{date_str}.{extension}")  
+      
     def save_data_efficiently(self, ohlcv_data: List, date_str: str, category_name: str, timeframe: str, symbol: str) -> bool:  
-        """Save OHLCV data to JSON and Excel files."""  
+        """Save OHLCV data to Parquet, plus optional JSON and Excel files.  
+          
+        The output directory must already exist; fetch_all_data_async creates it for every pair it fetches.  
+        Called on its own without that, this logs the missing directory and returns False.  
+        """  
+        if not ohlcv_data:  
+            logger.warning("No data to save for %s/%s %s", category_name, timeframe, symbol)  
+            return False  
+          
         try:  
-            # Create directory structure  
-            dir_path = f"{date_str}/{category_name}/{timeframe}"  
-            os.makedirs(dir_path, exist_ok=True)  
+            parquet_path = self._output_path(date_str, category_name, timeframe, symbol, 'parquet')  
+            json_path = self._output_path(date_str, category_name, timeframe, symbol, 'json')  
+            excel_path = self._output_path(date_str, category_name, timeframe, symbol, 'xlsx')  
               
-            # Create meaningful filenames  
-            clean_symbol = symbol.replace('/', '').replace(':', '')  
-            json_filename = f"{clean_symbol}_{timeframe}_{date_str}.json"  
-            excel_filename = f"{clean_symbol}_{timeframe}_{date_str}.xlsx"  
+            # Columns: timestamp, open, high, low, close, volume  
+            candles = np.fromiter(map(tuple, ohlcv_data), dtype=self.CANDLE_DTYPE, count=len(ohlcv_data))  
+            timestamps = candles['startTime']  
+            turnover = candles['openPrice'] * np.nan_to_num(candles['volume'])  
               
-            json_path = os.path.join(dir_path, json_filename)  
-            excel_path = os.path.join(dir_path, excel_filename)  
+            if self.emit_json or self.emit_xlsx:  
+                # Row-major values shared by the JSON and Excel writers, built once  
+                values = np.column_stack([candles[name] for name in self.PRICE_COLUMNS] + [turnover])  
+                rows = values.tolist()  
+                if np.isnan(values).any():  
+                    # Missing CCXT values became NaN in the float64 array; turn them back into None so the  
+                    # JSON still says "None" and Excel gets a blank cell rather than a #NUM! error  
+                    rows = [[None if value != value else value for value in row] for row in rows]  
               
-            if ohlcv_data:  
+            if self.emit_json:  
                 # Convert CCXT OHLCV format to your original format  
-                candles_data = []  
-                for candle in ohlcv_data:  
-                    candles_data.append([  
-                        candle[0],  # timestamp  
-                        str(candle[1]),  # open  
-                        str(candle[2]),  # high  
-                        str(candle[3]),  # low  
-                        str(candle[4]),  # close  
-                        str(candle[5]),  # volume  
-                        str(candle[1] * candle[5]) if candle[5] else "0"  # turnover  
-                    ])  
+                candles_data = [  
+                    [timestamp, str(open_), str(high), str(low), str(close), str(volume), str(value) if value else "0"]  
+                    for timestamp, (open_, high, low, close, volume, value) in zip(timestamps.tolist(), rows)  
+                ]  
                   
                 # Save JSON  
-                with open(json_path, 'w') as f:  
-                    json.dump(candles_data, f, indent=2)  
-                logger.info(f"Successfully wrote JSON to {json_path}")  
-                  
-                # Convert to DataFrame and save as Excel  
-                df = pd.DataFrame(candles_data, columns=[  
-                    'startTime', 'openPrice', 'highPrice', 'lowPrice',  
-                    'closePrice', 'volume', 'turnover'  
-                ])  
-                  
-                # Convert timestamps to readable format  
-                df['startTime'] = pd.to_datetime(df['startTime'].astype(int), unit='ms')  
-                df.to_excel(excel_path, index=False)  
-                  
-                logger.info(f"Saved {category_name}/{timeframe} data: {len(candles_data)} candles for {symbol}")  
-                return True  
-            else:  
-                logger.warning(f"No data to save for {category_name}/{timeframe} {symbol}")  
-                return False  
-                  
+                with open(json_path, 'wb') as f:  
+                    f.write(orjson.dumps(candles_data, option=orjson.OPT_INDENT_2))  
+                logger.debug("Successfully wrote JSON to %s", json_path)  
+              
+            # Imported on first save, so runs that find everything already saved skip loading pyarrow  
+            import pyarrow as pa  
+            import pyarrow.parquet as pq  
+              
+            # Build the Arrow table straight from the numeric columns  
+            table = pa.Table.from_arrays([  
+                # Exchange timestamps are UTC epoch milliseconds; record that in the column type  
+                pa.array(timestamps, type=pa.timestamp('ms', tz='UTC')),  
+                *(pa.array(candles[name]) for name in self.PRICE_COLUMNS),  
+                pa.array(turnover)  
+            ], names=self.CANDLE_COLUMNS)  
+              
+            # Save Parquet; the columns are all numeric, so dictionary encoding only adds overhead  
+            pq.write_table(table, parquet_path, compression='zstd', use_dictionary=False)  
+              
+            if self.emit_xlsx:  
+                self._write_excel(excel_path, timestamps, rows)  
+              
+            logger.info("Saved %s/%s data: %d candles for %s", category_name, timeframe, len(candles), symbol)  
+            return True  
+              
         except Exception as e:  
-            logger.error(f"Error saving {category_name}/{timeframe} data for {symbol}: {str(e)}")  
+            logger.error("Error saving %s/%s data for %s: %s", category_name, timeframe, symbol, e)  
             return False  
       
-    def fetch_all_data(self) -> bool:  
-        """Main method to fetch all OHLCV data for previous day."""  
-        logger.info(f"Starting data collection for {self.coin}")  
+    async def _fetch_and_save(self, executor: ThreadPoolExecutor, pending_writes: List[asyncio.Future],  
+                              category_name: str, timeframe: str, symbol: str,  
+                              date_str: str, start_time: int, end_time: int) -> None:  
+        """Fetch OHLCV data for a single category/timeframe pair and queue it for saving."""  
+        logger.debug("  Fetching %s interval data for %s", timeframe, symbol)  
           
-        # Test connectivity first  
-        if not self.test_server_time():  
-            logger.error("Exchange connectivity test failed, aborting data collection")  
+        # Fetch OHLCV data  
+        ohlcv_data = await self.fetch_ohlcv_data(symbol, timeframe, start_time, end_time)  
+          
+        if ohlcv_data:  
+            self._queue_save(executor, pending_writes, ohlcv_data, date_str, category_name, timeframe, symbol)  
+      
+    async def _fetch_and_save_resampled(self, executor: ThreadPoolExecutor, pending_writes: List[asyncio.Future],  
+                                        category_name: str, symbol: str, timeframes: List[str],  
+                                        date_str: str, start_time: int, end_time: int) -> None:  
+        """Fetch the 1m series once and build the other timeframes from it locally."""  
+        logger.debug("  Fetching 1m data for %s to resample into %s", symbol, timeframes)  
+          
+        minute_data = await self.fetch_ohlcv_data(symbol, '1m', start_time, end_time)  
+        if not minute_data:  
+            return  
+          
+        for timeframe in timeframes:  
+            if timeframe == '1m':  
+                ohlcv_data = minute_data  
+            else:  
+                ohlcv_data = self._resample_ohlcv(minute_data, start_time, self.timeframe_ms[timeframe])  
+            self._queue_save(executor, pending_writes, ohlcv_data, date_str, category_name, timeframe, symbol)  
+      
+    def _resample_ohlcv(self, ohlcv_data: List, start_time: int, timeframe_ms: int) -> List:  
+        """Aggregate sorted 1m candles into timeframe_ms candles aligned to start_time."""  
+        ohlcv = np.asarray(ohlcv_data, dtype=np.float64)  
+        timestamps = np.fromiter((candle[0] for candle in ohlcv_data), dtype=np.int64, count=len(ohlcv_data))  
+        buckets = (timestamps - start_time) // timeframe_ms  
+          
+        # Candles are sorted, so each bucket is a contiguous run starting where the bucket number changes  
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])  
+        ends = np.r_[starts[1:], len(ohlcv)] - 1  
+          
+        bucket_times = start_time + buckets[starts] * timeframe_ms  
+        # Open of the first candle, highest high, lowest low, close of the last candle, total volume  
+        values = np.column_stack((  
+            ohlcv[starts, 1],  
+            np.maximum.reduceat(ohlcv[:, 2], starts),  
+            np.minimum.reduceat(ohlcv[:, 3], starts),  
+            ohlcv[ends, 4],  
+            np.add.reduceat(np.nan_to_num(ohlcv[:, 5]), starts),  
+        ))  
+        return [[timestamp, *row] for timestamp, row in zip(bucket_times.tolist(), values.tolist())]  
+      
+    def _queue_save(self, executor: ThreadPoolExecutor, pending_writes: List[asyncio.Future], ohlcv_data: List,  
+                    date_str: str, category_name: str, timeframe: str, symbol: str) -> None:  
+        """Save data in the background; the caller waits on pending_writes once all downloads are done."""  
+        loop = asyncio.get_running_loop()  
+        pending_writes.append(loop.run_in_executor(  
+            executor, self._save_and_record, ohlcv_data, date_str, category_name, timeframe, symbol  
+        ))  
+      
+    def _save_and_record(self, ohlcv_data: List, date_str: str, category_name: str, timeframe: str, symbol: str) -> bool:  
+        """Save the data and, if that worked, record it in the done cache."""  
+        if not self.save_data_efficiently(ohlcv_data, date_str, category_name, timeframe, symbol):  
             return False  
+        self._mark_done(date_str, category_name, timeframe,  
+                        self._output_path(date_str, category_name, timeframe, symbol, 'parquet'))  
+        return True  
+      
+    def fetch_all_data(self) -> bool:  
+        """Main method to fetch all OHLCV data for previous day."""  
+        return asyncio.run(self._fetch_all_data_and_close())  
+      
+    async def _fetch_all_data_and_close(self) -> bool:  
+        """Run a single collection and release the async exchange afterwards."""  
+        try:  
+            return await self.fetch_all_data_async()  
+        finally:  
+            await self.close_async()  
+      
+    async def fetch_all_data_async(self, now: Optional[datetime] = None) -> bool:  
+        """Fetch all OHLCV data for the day before `now` (default: the current time) concurrently."""  
+        logger.info("Starting data collection for %s", self.coin)  
           
-        date_str, start_time, end_time = self.get_previous_day_timestamps()  
-        logger.info(f"Fetching data for {date_str} (UTC)")  
-        logger.info(f"Time range: {start_time} to {end_time}")  
+        date_str, start_time, end_time = self.get_previous_day_timestamps(now)  
+        logger.info("Fetching data for %s (UTC)", date_str)  
+        logger.info("Time range: %s to %s", start_time, end_time)  
           
-        success_count = 0  
-        total_requests = 0  
+        # Files saved by an earlier run for this day are skipped, as long as they are still on disk  
+        done = self._load_done(date_str)  
           
-        for category_name, category_type in self.categories.items():  
-            logger.info(f"Processing {category_name} category")  
+        tasks = []  
+        skipped = 0  
+        for category_name in self.categories:  
+            logger.info("Processing %s category", category_name)  
               
-            # Select appropriate symbol based on category  
-            if category_name == 'spot':  
-                symbol = self.spot_symbol  
-            elif category_name == 'perpetual':  
-                symbol = self.perp_symbol  
-                if not symbol:  
-                    logger.warning(f"Skipping perpetual category - no symbol found")  
-                    continue  
+            symbol = self.category_symbols[category_name]  
+            if not symbol:  
+                logger.warning("Skipping %s category - no symbol found", category_name)  
+                continue  
               
             for timeframe in self.timeframes.keys():  
-                logger.info(f"  Fetching {timeframe} interval data for {symbol}")  
-                total_requests += 1  
-                  
-                # Fetch OHLCV data  
-                ohlcv_data = self.fetch_ohlcv_data(symbol, timeframe, start_time, end_time)  
-                  
-                if ohlcv_data:  
-                    # Save data  
-                    if self.save_data_efficiently(ohlcv_data, date_str, category_name, timeframe, symbol):  
-                        success_count += 1  
-                  
-                # Rate limiting  
-                time.sleep(0.2)  
+                path = done.get((category_name, timeframe))  
+                if path and os.path.exists(path):  
+                    logger.debug("Skipping %s/%s, already saved to %s", category_name, timeframe, path)  
+                    skipped += 1  
+                    continue  
+                tasks.append((category_name, timeframe, symbol))  
+          
+        # Longest jobs first: the shortest timeframes need the most pages, so they claim request slots  
+        # before the single-request ones instead of queueing behind them and stretching the run  
+        tasks.sort(key=lambda task: self.timeframe_ms[task[1]])  
+          
+        total_requests = len(tasks) + skipped  
+        if skipped:  
+            logger.info("Skipping %d files already saved for %s", skipped, date_str)  
+        if not tasks:  
+            logger.info("All data for %s is already saved", date_str)  
+            return True  
+          
+        # Test connectivity first, over the same connection pool the downloads use  
+        self._open_async_exchange()  
+        if not await self.test_server_time():  
+            logger.error("Exchange connectivity test failed, aborting data collection")  
+            return False  
+          
+        # Create the directory structure once up front rather than in every save  
+        for category_name, timeframe, _ in tasks:  
+            os.makedirs(self._output_dir(date_str, category_name, timeframe), exist_ok=True)  
+          
+        # Downloads overlap on the event loop, throttled by the token bucket, while file writes run in a thread pool  
+        pending_writes = []  
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:  
+            jobs = []  
+            if self.resample_from_1m and '1m' in self.timeframes:  
+                # Timeframes that tile the day are derived from one 1m download per category  
+                day_ms = end_time - start_time + 1  
+                resampled = {}  
+                remaining_tasks = []  
+                for category_name, timeframe, symbol in tasks:  
+                    if day_ms % self.timeframe_ms[timeframe] == 0:  
+                        resampled.setdefault((category_name, symbol), []).append(timeframe)  
+                    else:  
+                        remaining_tasks.append((category_name, timeframe, symbol))  
+                tasks = remaining_tasks  
+                for (category_name, symbol), timeframes in resampled.items():  
+                    jobs.append(self._fetch_and_save_resampled(executor, pending_writes, category_name, symbol,  
+                                                               timeframes, date_str, start_time, end_time))  
               
-            # Additional delay between categories  
-            time.sleep(0.5)  
+            jobs.extend(  
+                self._fetch_and_save(executor, pending_writes, category_name, timeframe, symbol,  
+                                     date_str, start_time, end_time)  
+                for category_name, timeframe, symbol in tasks  
+            )  
+              
+            await asyncio.gather(*jobs)  
+            results = await asyncio.gather(*pending_writes)  
+          
+        success_count = sum(results) + skipped  
           
-        logger.info(f"Data collection completed: {success_count}/{total_requests} successful")  
+        logger.info("Data collection completed: %d/%d successful", success_count, total_requests)  
         return success_count == total_requests  
+      
+    def run_daemon(self) -> None:  
+        """Collect the previous day's data once a day, keeping connections open between runs."""  
+        asyncio.run(self.run_daemon_async())  
+      
+    async def run_daemon_async(self) -> None:  
+        """Sleep until DAEMON_RUN_OFFSET past each UTC midnight, then fetch all data."""  
+        try:  
+            while True:  
+                now = datetime.now(timezone.utc)  
+                next_run = now.replace(hour=0, minute=0, second=0, microsecond=0) + self.DAEMON_RUN_OFFSET  
+                if next_run <= now:  
+                    next_run += timedelta(days=1)  
+                  
+                logger.info("Next data collection at %s", next_run.isoformat())  
+                await asyncio.sleep((next_run - now).total_seconds())  
+                  
+                try:  
+                    # Pin the day to the scheduled wake-up, so a late wake-up still collects the intended day  
+                    if not await self.fetch_all_data_async(now=next_run):  
+                        logger.error("Some %s%s data fetching failed", self.coin, self.base_currency)  
+                except Exception as e:  
+                    logger.error("Data collection run failed: %s", e)  
+        finally:  
+            await self.close_async()  
   
 def main():  
     """Main execution function with configurable coin support."""  
     coin = os.getenv('COIN', 'BTC')  
     base_currency = os.getenv('BASE_CURRENCY', 'USDT')  
     exchange_id = os.getenv('EXCHANGE', 'coinbaseadvanced')  
+    max_workers = int(os.getenv('MAX_WORKERS', '8'))  
+    emit_json = os.getenv('EMIT_JSON', '1') == '1'  
+    emit_xlsx = os.getenv('EMIT_XLSX', '1') == '1'  
+    include_perpetual = os.getenv('INCLUDE_PERPETUAL', '1') == '1'  
+    max_concurrency = int(os.getenv('MAX_CONCURRENCY', '8'))  
+    resample_from_1m = os.getenv('RESAMPLE_FROM_1M', '0') == '1'  
+      
+    fetcher = CryptoDataFetcher(coin=coin, base_currency=base_currency, exchange_id=exchange_id,  
+                                max_workers=max_workers, emit_json=emit_json, emit_xlsx=emit_xlsx,  
+                                include_perpetual=include_perpetual, max_concurrency=max_concurrency,  
+                                resample_from_1m=resample_from_1m)  
+      
+    # Long-running mode keeps one exchange session alive across days instead of restarting under cron  
+    if os.getenv('DAEMON', '0') == '1':  
+        fetcher.run_daemon()  
+        return  
       
-    fetcher = CryptoDataFetcher(coin=coin, base_currency=base_currency, exchange_id=exchange_id)  
     success = fetcher.fetch_all_data()  
       
     if success:  
-        logger.info(f"All {coin}{base_currency} data fetched successfully")  
+        logger.info("All %s%s data fetched successfully", coin, base_currency)  
         exit(0)  
     else:  
-        logger.error(f"Some {coin}{base_currency} data fetching failed")  
+        logger.error("Some %s%s data fetching failed", coin, base_currency)  
         exit(1)  
   
 if __name__ == "__main__":  